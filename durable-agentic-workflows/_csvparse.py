@@ -0,0 +1,25 @@
+import asyncio
+import io
+import polars as pl
+
+# CSV text at least this big is parsed on a worker thread so the event loop
+# stays free; smaller inputs parse faster inline than a thread hop costs
+THREAD_PARSE_THRESHOLD = 256 * 1024
+
+def _parse_csv(data: bytes) -> pl.DataFrame:
+    # Empty input is an empty table (polars raises NoDataError), matching csv.DictReader
+    if not data.strip():
+        return pl.DataFrame()
+    # Every column as a string so values keep their CSV form (e.g. JSON-safe dict keys);
+    # numeric columns are cast explicitly where they are aggregated. Extra fields on
+    # ragged rows are dropped rather than failing the whole parse.
+    df = pl.read_csv(io.BytesIO(data), infer_schema_length=0, truncate_ragged_lines=True)
+    # Drop blank lines (all-null rows), matching csv.DictReader
+    return df.filter(~pl.all_horizontal(pl.all().is_null()))
+
+async def parse_csv_frame(csv_text: str) -> pl.DataFrame:
+    """Parse CSV content shipped through Temporal into a columnar DataFrame"""
+    data = csv_text.encode()
+    if len(data) >= THREAD_PARSE_THRESHOLD:
+        return await asyncio.to_thread(_parse_csv, data)
+    return _parse_csv(data)
@@ -0,0 +1,26 @@
+from functools import lru_cache
+from hashlib import blake2b
+from typing import Optional
+import diskcache
+
+@lru_cache(maxsize=1)
+def _get_cache() -> diskcache.Cache:
+    """On-disk cache of raw LLM outputs, shared by all activities in this worker.
+    Opened on first use so workers with the LLM paths disabled never create it."""
+    return diskcache.Cache("./.llm_cache")
+
+def content_digest(data: bytes) -> bytes:
+    """BLAKE2b digest of input content (e.g. a CSV shipped through the workflow)"""
+    return blake2b(data).digest()
+
+def make_key(content_digest: bytes, model_id: str, prompt_template_version: bytes) -> str:
+    """Content-addressed key: same input content + model + prompt template -> same key"""
+    return blake2b(content_digest + b"|" + model_id.encode() + b"|" + prompt_template_version).hexdigest()
+
+def get(key: str) -> Optional[dict]:
+    """Return the cached LLM output for key, or None on miss"""
+    return _get_cache().get(key)
+
+def put(key: str, value: dict) -> None:
+    """Store the raw LLM output for key"""
+    _get_cache().set(key, value)
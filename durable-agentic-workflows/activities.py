@@ -2,9 +2,46 @@ from temporalio import activity
 from agno.agent import Agent
 from agno.models.openai import OpenAIChat
 from pydantic import BaseModel
-import csv
-import json
+import httpx
+import tiktoken
+import orjson
+import math
 import os
+import random
+from collections import Counter
+from functools import lru_cache
+from typing import Optional
+import polars as pl
+import _llm_cache
+from _csvparse import parse_csv_frame
+
+MODEL_ID = "gpt-4o-mini"
+
+# Contact and opportunity stats are exact aggregations, so the LLM is opt-in (kept for the demo)
+USE_LLM_CONTACT_ANALYSIS = os.getenv("USE_LLM_CONTACT_ANALYSIS", "0") == "1"
+USE_LLM_OPPORTUNITY_ANALYSIS = os.getenv("USE_LLM_OPPORTUNITY_ANALYSIS", "0") == "1"
+
+# Bump these when a prompt changes so stale cached outputs are not reused
+CONTACTS_PROMPT_VERSION = b"contacts-v3"
+OPPORTUNITIES_PROMPT_VERSION = b"opportunities-v3"
+FULL_PROMPT_VERSION = b"full-v1"
+
+# Upper bound on raw rows embedded in any LLM prompt
+MAX_ROWS_FOR_LLM_SAMPLE = 50
+
+# Largest prompt sent to the model (gpt-4o-mini's context window is 128k tokens)
+MAX_PROMPT_TOKENS = 100_000
+
+# Contact results carry only the largest companies, not the full per-company
+# distribution, to keep activity payloads and workflow history small
+TOP_COMPANIES_LIMIT = 10
+
+# Fields every analysis of each type must contain
+_REQUIRED_CONTACTS = frozenset({"total_contacts", "unique_companies", "top_company", "top_companies", "companies_distribution_sum", "unique_titles"})
+_REQUIRED_OPPS = frozenset({"total_opportunities", "total_pipeline_value", "won_value", "stages_breakdown", "win_rate"})
+
+# Analysis fields holding a 0-1 ratio (range-checked instead of sign-checked)
+_RATE_KEYS = frozenset({"win_rate"})
 
 # Define Pydantic models for structured outputs
 class TopCompany(BaseModel):
@@ -25,243 +62,460 @@ class OpportunityAnalysis(BaseModel):
     stages_breakdown: dict[str, int]
     win_rate: float
 
-class ValidationResult(BaseModel):
-    passed: bool
-    reason: str
-
-@activity.defn
-async def analyze_contacts(file_path: str) -> dict:
-    """Analyze CRM contacts using Agno AI agent"""
-    activity.logger.info(f"Analyzing contacts from {file_path}")
-
-    # Load CSV data
-    with open(file_path) as f:
-        contacts = list(csv.DictReader(f))
-
-    # Compute unique_titles deterministically from data (avoid AI counting errors)
-    unique_titles = len(set(row.get("title", "") for row in contacts if row.get("title")))
-
-    # Create Agno agent with structured output
-    agent = Agent(
-        model=OpenAIChat(id="gpt-4o-mini", api_key=os.getenv("OPENAI_API_KEY")),
-        description="You are a CRM data analyst. Analyze contact data and extract key insights.",
-        output_schema=ContactAnalysis,
+class CRMFullAnalysis(BaseModel):
+    contacts: ContactAnalysis
+    opportunities: OpportunityAnalysis
+
+# Agent roles: (role, output schema name) -> (description, output schema)
+_AGENT_SPECS = {
+    ("crm_contacts", "ContactAnalysis"): (
+        "You are a CRM data analyst. Analyze contact data and extract key insights.",
+        ContactAnalysis
+    ),
+    ("crm_opportunities", "OpportunityAnalysis"): (
+        "You are a sales pipeline analyst. Analyze opportunity data and extract revenue insights.",
+        OpportunityAnalysis
+    ),
+    ("crm_full", "CRMFullAnalysis"): (
+        "You are a CRM data analyst. Analyze contact and opportunity data and extract key insights.",
+        CRMFullAnalysis
+    )
+}
+
+@lru_cache(maxsize=1)
+def _get_http_client() -> httpx.Client:
+    """One pooled HTTP client per worker so OpenAI connections stay warm between calls"""
+    return httpx.Client(limits=httpx.Limits(max_keepalive_connections=16))
+
+@lru_cache(maxsize=8)
+def _get_agent(role: str, schema_name: str) -> Agent:
+    """Build each agent once per worker instead of on every activity invocation"""
+    description, output_schema = _AGENT_SPECS[(role, schema_name)]
+    return Agent(
+        model=OpenAIChat(id=MODEL_ID, api_key=os.getenv("OPENAI_API_KEY"), http_client=_get_http_client()),
+        description=description,
+        output_schema=output_schema,
         structured_outputs=True
     )
 
-    # Build prompt with data
-    data_str = json.dumps(contacts, indent=2)
-    prompt = f"""Analyze this CRM contacts data:
-
-{data_str}
+def _sample_frame(df: pl.DataFrame) -> list:
+    """Uniform random sample of at most MAX_ROWS_FOR_LLM_SAMPLE rows"""
+    return df.sample(n=min(MAX_ROWS_FOR_LLM_SAMPLE, df.height)).to_dicts()
+
+def _column(df: pl.DataFrame, name: str) -> pl.Series:
+    """Column by name, or all nulls if the CSV lacks it (like row.get on a missing key)"""
+    if name in df.columns:
+        return df[name]
+    return pl.repeat(None, df.height, dtype=pl.String, eager=True).alias(name)
+
+def _non_empty(series: pl.Series) -> pl.Series:
+    return series.filter(series.is_not_null() & (series != ""))
+
+def _contact_stats(df: pl.DataFrame, with_sample: bool = False) -> dict:
+    """Vectorized contact aggregates - memory beyond the frame is O(unique companies)"""
+    # First-seen order so most_common breaks ties the same way on every run
+    company_counts = (
+        _non_empty(_column(df, "company")).to_frame()
+        .group_by("company", maintain_order=True)
+        .agg(pl.len().alias("count"))
+    )
+    companies = Counter(dict(zip(company_counts["company"].to_list(), company_counts["count"].to_list())))
+    return {
+        "total": df.height,
+        "companies": companies,
+        "unique_titles": _non_empty(_column(df, "title")).n_unique(),
+        "sample": _sample_frame(df) if with_sample else []
+    }
 
-Extract:
-- total_contacts: total number of contacts (count all rows)
-- unique_companies: number of unique companies (count distinct company values)
-- top_company: company with most contacts (name and count)
-- companies_distribution: all companies with their contact counts (dict of company_name: count)
-- unique_titles: number of unique job titles (count distinct title values - be careful to count each unique title exactly once)
+def _parse_amounts(amounts: pl.Series) -> pl.Series:
+    """Amounts as floats - padding is stripped, blank or non-numeric values count as 0 (and are logged)
+
+    >>> _parse_amounts(pl.Series("amount", [" 5 ", "N/A", "", None, "2.5"])).to_list()
+    [5.0, 0.0, 0.0, 0.0, 2.5]
+    """
+    stripped = amounts.str.strip_chars()
+    parsed = stripped.cast(pl.Float64, strict=False)
+    invalid = (parsed.is_null() & stripped.is_not_null() & (stripped != "")).sum()
+    if invalid:
+        activity.logger.warning(f"{invalid} non-numeric amount value(s) counted as 0")
+    return parsed.fill_null(0.0)
+
+def _opportunity_stats(df: pl.DataFrame, with_sample: bool = False) -> dict:
+    """Per-stage counts and amount sums in one grouped pass over the columnar frame"""
+    by_stage = (
+        df.select(
+            _column(df, "stage").fill_null(""),
+            _parse_amounts(_column(df, "amount"))
+        )
+        .group_by("stage", maintain_order=True)
+        .agg(pl.len().alias("count"), pl.col("amount").sum())
+    )
+    stages = by_stage["stage"].to_list()
+    stage_amounts = dict(zip(stages, by_stage["amount"].to_list()))
+    return {
+        "total": df.height,
+        "total_amount": float(by_stage["amount"].sum()),
+        "won_amount": stage_amounts.get("Closed Won", 0.0),
+        "stages": dict(zip(stages, by_stage["count"].to_list())),
+        "stage_amounts": stage_amounts,
+        "sample": _sample_frame(df) if with_sample else []
+    }
 
-IMPORTANT: Count unique_titles by examining each distinct title value in the data. Do not skip any titles."""
+def _contact_source_stats(stats: dict) -> dict:
+    """Compact source-of-truth numbers handed to validate_analysis so it never re-reads the CSV"""
+    return {
+        "total": stats["total"],
+        "unique_companies": len(stats["companies"]),
+        "unique_titles": stats["unique_titles"],
+        "dist_sum": sum(stats["companies"].values())
+    }
 
-    # Run agent - returns Pydantic model
-    response = agent.run(prompt)
+def _opportunity_source_stats(stats: dict) -> dict:
+    """Compact source-of-truth numbers handed to validate_analysis so it never re-reads the CSV"""
+    return {
+        "total": stats["total"],
+        "total_amount": stats["total_amount"],
+        "won_amount": stats["won_amount"]
+    }
 
-    # Convert Pydantic model to dict
-    result = response.content.model_dump()
+def _contact_result(stats: dict) -> dict:
+    """Build the contact analysis directly from the company counts"""
+    company_counter = stats["companies"]
+    top_name, top_count = company_counter.most_common(1)[0] if company_counter else ("", 0)
+    return {
+        "total_contacts": stats["total"],
+        "unique_companies": len(company_counter),
+        "top_company": {"name": top_name, "count": top_count},
+        "top_companies": [{"name": name, "count": count} for name, count in company_counter.most_common(TOP_COMPANIES_LIMIT)],
+        "companies_distribution_sum": sum(company_counter.values()),
+        "unique_titles": stats["unique_titles"]
+    }
 
+def _finalize_llm_contact_result(result: dict, stats: dict) -> dict:
+    """Apply deterministic overrides to a raw LLM contact analysis and compact its distribution"""
     # Override unique_titles with deterministic computation to ensure accuracy
-    result["unique_titles"] = unique_titles
+    result["unique_titles"] = stats["unique_titles"]
 
+    distribution = Counter(result.pop("companies_distribution", {}))
+    result["top_companies"] = [{"name": name, "count": count} for name, count in distribution.most_common(TOP_COMPANIES_LIMIT)]
+    result["companies_distribution_sum"] = sum(distribution.values())
     return result
 
-@activity.defn
-async def analyze_opportunities(file_path: str) -> dict:
-    """Analyze CRM opportunities using Agno AI agent"""
-    activity.logger.info(f"Analyzing opportunities from {file_path}")
-
-    # Load CSV data
-    with open(file_path) as f:
-        opps = list(csv.DictReader(f))
-
-    # Create Agno agent with structured output
-    agent = Agent(
-        model=OpenAIChat(id="gpt-4o-mini", api_key=os.getenv("OPENAI_API_KEY")),
-        description="You are a sales pipeline analyst. Analyze opportunity data and extract revenue insights.",
-        output_schema=OpportunityAnalysis,
-        structured_outputs=True
-    )
+def _opportunity_result(stats: dict) -> dict:
+    """Build the opportunity analysis directly from the per-stage aggregates"""
+    total_amount = stats["total_amount"]
+    return {
+        "total_opportunities": stats["total"],
+        "total_pipeline_value": total_amount,
+        "won_value": stats["won_amount"],
+        "stages_breakdown": stats["stages"],
+        "win_rate": stats["won_amount"] / total_amount if total_amount else 0.0
+    }
+
+def _sample_rows(stats: dict, sample_size: int) -> list:
+    """Random subset of the row sample, used to shrink prompts that are over budget"""
+    rows = stats["sample"]
+    return rows if len(rows) <= sample_size else random.sample(rows, sample_size)
+
+def _contacts_data_section(stats: dict, sample_size: int = MAX_ROWS_FOR_LLM_SAMPLE) -> str:
+    """Prompt section with contact aggregates plus a small sample instead of every row"""
+    aggregates = {
+        "total_contacts": stats["total"],
+        "contacts_per_company": dict(stats["companies"]),
+        "unique_titles": stats["unique_titles"]
+    }
+    return f"""Aggregates computed over all {stats["total"]} rows:
+
+{orjson.dumps(aggregates).decode()}
+
+Representative sample of rows:
+
+{orjson.dumps(_sample_rows(stats, sample_size)).decode()}"""
+
+def _opportunities_data_section(stats: dict, sample_size: int = MAX_ROWS_FOR_LLM_SAMPLE) -> str:
+    """Prompt section with opportunity aggregates plus a small sample instead of every row"""
+    aggregates = {
+        "total_opportunities": stats["total"],
+        "sum_of_amounts": stats["total_amount"],
+        "sum_of_closed_won_amounts": stats["won_amount"],
+        "count_per_stage": stats["stages"],
+        "amount_per_stage": stats["stage_amounts"]
+    }
+    return f"""Aggregates computed over all {stats["total"]} rows:
+
+{orjson.dumps(aggregates).decode()}
 
-    # Build prompt with data
-    data_str = json.dumps(opps, indent=2)
-    prompt = f"""Analyze this CRM opportunities data:
+Representative sample of rows:
 
-{data_str}
+{orjson.dumps(_sample_rows(stats, sample_size)).decode()}"""
 
-Extract:
+_CONTACTS_EXTRACT = """Extract:
+- total_contacts: total number of contacts
+- unique_companies: number of unique companies
+- top_company: company with most contacts (name and count)
+- companies_distribution: all companies with their contact counts (dict of company_name: count)
+- unique_titles: number of unique job titles
+
+IMPORTANT: Use the aggregates for counts - the sample is only for context."""
+
+_OPPORTUNITIES_EXTRACT = """Extract:
 - total_opportunities: total number of opportunities
 - total_pipeline_value: sum of all amounts
 - won_value: sum of amounts where stage is "Closed Won"
 - stages_breakdown: all stages with their opportunity counts
-- win_rate: won_value / total_pipeline_value (between 0 and 1)"""
+- win_rate: won_value / total_pipeline_value (between 0 and 1)
 
-    # Run agent - returns Pydantic model
-    response = agent.run(prompt)
+IMPORTANT: Use the aggregates for totals - the sample is only for context."""
 
-    # Convert Pydantic model to dict
-    return response.content.model_dump()
+def _contacts_prompt(stats: dict, sample_size: int) -> str:
+    return f"""Analyze this CRM contacts data.
 
-def deterministic_validate(analysis_type: str, analysis: dict, schema: dict, source_data: list = None) -> dict:
-    """Fast deterministic validation - check fields, types, and ranges"""
+{_contacts_data_section(stats, sample_size)}
 
-    # Check for missing required fields
-    missing = [f for f in schema["required_fields"] if f not in analysis]
-    if missing:
-        return {"passed": False, "reason": f"Missing fields: {', '.join(missing)}"}
+{_CONTACTS_EXTRACT}"""
 
-    # Check for negative values
-    for key, value in analysis.items():
-        if isinstance(value, (int, float)) and "rate" not in key.lower():
-            if value < 0:
-                return {"passed": False, "reason": f"Negative value for {key}: {value}"}
+def _opportunities_prompt(stats: dict, sample_size: int) -> str:
+    return f"""Analyze this CRM opportunities data.
 
-    # Check rate/percentage fields are between 0 and 1
-    for key, value in analysis.items():
-        if isinstance(value, (int, float)) and "rate" in key.lower():
-            if not (0 <= value <= 1):
-                return {"passed": False, "reason": f"Invalid rate {key}: {value}"}
+{_opportunities_data_section(stats, sample_size)}
 
-    # Logical consistency checks
-    if analysis_type == "contacts":
-        if analysis.get("total_contacts", 0) < analysis.get("unique_companies", 0):
-            return {"passed": False, "reason": "total_contacts < unique_companies"}
+{_OPPORTUNITIES_EXTRACT}"""
 
-        # Cross-reference with actual data if available
-        if source_data:
-            actual_total = len(source_data)
-            actual_unique_companies = len(set(row.get("company", "") for row in source_data if row.get("company")))
-            actual_unique_titles = len(set(row.get("title", "") for row in source_data if row.get("title")))
+def _full_prompt(stats: tuple, sample_size: int) -> str:
+    contact_stats, opp_stats = stats
+    return f"""Analyze this CRM data. It has two datasets: contacts and opportunities.
 
-            if analysis.get("total_contacts") != actual_total:
-                return {"passed": False, "reason": f"total_contacts mismatch: reported {analysis.get('total_contacts')}, actual {actual_total}"}
+=== CONTACTS ===
 
-            if analysis.get("unique_companies") != actual_unique_companies:
-                return {"passed": False, "reason": f"unique_companies mismatch: reported {analysis.get('unique_companies')}, actual {actual_unique_companies}"}
+{_contacts_data_section(contact_stats, sample_size)}
 
-            if analysis.get("unique_titles") != actual_unique_titles:
-                return {"passed": False, "reason": f"unique_titles mismatch: reported {analysis.get('unique_titles')}, actual {actual_unique_titles}"}
+{_CONTACTS_EXTRACT}
 
-            # Verify companies_distribution sums to total_contacts
-            dist_sum = sum(analysis.get("companies_distribution", {}).values())
-            if dist_sum != actual_total:
-                return {"passed": False, "reason": f"companies_distribution sum ({dist_sum}) doesn't match total_contacts ({actual_total})"}
-    elif analysis_type == "opportunities":
-        if analysis.get("won_value", 0) > analysis.get("total_pipeline_value", 0):
-            return {"passed": False, "reason": "won_value > total_pipeline_value"}
+=== OPPORTUNITIES ===
 
-    return {"passed": True, "reason": "Deterministic checks passed"}
+{_opportunities_data_section(opp_stats, sample_size)}
+
+{_OPPORTUNITIES_EXTRACT}
+
+Return the contacts analysis under "contacts" and the opportunities analysis under "opportunities"."""
+
+@lru_cache(maxsize=1)
+def _get_encoding() -> tiktoken.Encoding:
+    return tiktoken.encoding_for_model(MODEL_ID)
+
+def warm_tokenizer() -> None:
+    """Load the tokenizer at worker boot instead of on the event loop in the first activity.
+    tiktoken downloads the BPE file on first load - set TIKTOKEN_CACHE_DIR to a persistent
+    directory to skip the download on restarts. No-op when AI analysis is disabled."""
+    if USE_LLM_CONTACT_ANALYSIS or USE_LLM_OPPORTUNITY_ANALYSIS:
+        _get_encoding()
+
+def _call_llm_safe(agent: Agent, prompt_builder, data) -> Optional[dict]:
+    """Run agent on prompt_builder(data, sample_size), halving the row sample until the prompt
+    fits MAX_PROMPT_TOKENS. Returns None without any network call if it never fits."""
+    sample_size = MAX_ROWS_FOR_LLM_SAMPLE
+    while True:
+        prompt = prompt_builder(data, sample_size)
+        ntok = len(_get_encoding().encode(prompt))
+        activity.logger.info(f"LLM prompt is {ntok} tokens ({sample_size} sample rows)")
+        if ntok <= MAX_PROMPT_TOKENS:
+            break
+        if sample_size == 0:
+            return None
+        sample_size //= 2
+
+    # Run agent - returns Pydantic model, converted to a plain dict
+    response = agent.run(prompt)
+    return orjson.loads(response.content.model_dump_json())
+
+def _contacts_analysis(contacts_csv: str, stats: dict) -> dict:
+    """Contact analysis from parsed stats - deterministic unless USE_LLM_CONTACT_ANALYSIS is set"""
+    source_stats = _contact_source_stats(stats)
+
+    if not USE_LLM_CONTACT_ANALYSIS:
+        return {"result": _contact_result(stats), "_source_stats": source_stats}
+
+    # Same CSV + model + prompt -> reuse the previous LLM output
+    cache_key = _llm_cache.make_key(_llm_cache.content_digest(contacts_csv.encode()), MODEL_ID, CONTACTS_PROMPT_VERSION)
+    result = _llm_cache.get(cache_key)
+    if result is not None:
+        activity.logger.info("LLM cache hit for contacts analysis")
+        return {"result": _finalize_llm_contact_result(result, stats), "_source_stats": source_stats}
+
+    # Reuse the worker's prebuilt agent for this role
+    agent = _get_agent("crm_contacts", "ContactAnalysis")
+    result = _call_llm_safe(agent, _contacts_prompt, stats)
+    if result is None:
+        activity.logger.info("Contacts prompt over token budget - using deterministic analysis")
+        return {"result": _contact_result(stats), "_source_stats": source_stats}
+
+    # Cache the raw LLM output
+    _llm_cache.put(cache_key, result)
+
+    return {"result": _finalize_llm_contact_result(result, stats), "_source_stats": source_stats}
+
+def _opportunities_analysis(opportunities_csv: str, stats: dict) -> dict:
+    """Opportunity analysis from parsed stats - deterministic unless USE_LLM_OPPORTUNITY_ANALYSIS is set"""
+    source_stats = _opportunity_source_stats(stats)
+
+    if not USE_LLM_OPPORTUNITY_ANALYSIS:
+        return {"result": _opportunity_result(stats), "_source_stats": source_stats}
+
+    # Same CSV + model + prompt -> reuse the previous LLM output
+    cache_key = _llm_cache.make_key(_llm_cache.content_digest(opportunities_csv.encode()), MODEL_ID, OPPORTUNITIES_PROMPT_VERSION)
+    cached = _llm_cache.get(cache_key)
+    if cached is not None:
+        activity.logger.info("LLM cache hit for opportunities analysis")
+        return {"result": cached, "_source_stats": source_stats}
+
+    # Reuse the worker's prebuilt agent for this role
+    agent = _get_agent("crm_opportunities", "OpportunityAnalysis")
+    result = _call_llm_safe(agent, _opportunities_prompt, stats)
+    if result is None:
+        activity.logger.info("Opportunities prompt over token budget - using deterministic analysis")
+        return {"result": _opportunity_result(stats), "_source_stats": source_stats}
+
+    # Cache the raw LLM output
+    _llm_cache.put(cache_key, result)
+    return {"result": result, "_source_stats": source_stats}
 
 @activity.defn
-async def validate_analysis(analysis_type: str, analysis: dict, source_file: str = None) -> dict:
-    """Hybrid validation: fast deterministic checks, then AI semantic analysis"""
-    activity.logger.info(f"Validating {analysis_type} analysis")
+async def analyze_contacts(contacts_csv: str) -> dict:
+    """Analyze CRM contacts with plain counters (or an Agno AI agent if enabled)"""
+    activity.logger.info(f"Analyzing contacts ({len(contacts_csv)} characters of CSV)")
 
-    # Define expected schema
-    if analysis_type == "contacts":
-        schema = {
-            "required_fields": ["total_contacts", "unique_companies", "top_company", "companies_distribution", "unique_titles"]
+    # Compute all contact stats deterministically with vectorized polars aggregations
+    stats = _contact_stats(await parse_csv_frame(contacts_csv), with_sample=USE_LLM_CONTACT_ANALYSIS)
+    return _contacts_analysis(contacts_csv, stats)
+
+@activity.defn
+async def analyze_opportunities(opportunities_csv: str) -> dict:
+    """Analyze CRM opportunities with vectorized aggregations (or an Agno AI agent if enabled)"""
+    activity.logger.info(f"Analyzing opportunities ({len(opportunities_csv)} characters of CSV)")
+
+    # Aggregate with one grouped polars pass (only a compact summary ever goes to the LLM)
+    stats = _opportunity_stats(await parse_csv_frame(opportunities_csv), with_sample=USE_LLM_OPPORTUNITY_ANALYSIS)
+    return _opportunities_analysis(opportunities_csv, stats)
+
+@activity.defn
+async def analyze_all(contacts_csv: str, opportunities_csv: str) -> dict:
+    """Analyze contacts and opportunities together - one LLM call instead of two when both use AI.
+    Returns {"split": True} when the combined prompt is over budget, so the workflow runs the
+    split activities in parallel instead."""
+    activity.logger.info(f"Analyzing contacts ({len(contacts_csv)} characters) and opportunities ({len(opportunities_csv)} characters of CSV)")
+
+    contact_stats = _contact_stats(await parse_csv_frame(contacts_csv), with_sample=USE_LLM_CONTACT_ANALYSIS)
+    opp_stats = _opportunity_stats(await parse_csv_frame(opportunities_csv), with_sample=USE_LLM_OPPORTUNITY_ANALYSIS)
+
+    # With at most one dataset on AI there is nothing to batch, so both analyses finish here
+    if not (USE_LLM_CONTACT_ANALYSIS and USE_LLM_OPPORTUNITY_ANALYSIS):
+        return {
+            "contacts": _contacts_analysis(contacts_csv, contact_stats),
+            "opportunities": _opportunities_analysis(opportunities_csv, opp_stats)
         }
+
+    # Both CSVs + model + prompt -> reuse the previous LLM output
+    cache_key = _llm_cache.make_key(
+        _llm_cache.content_digest(contacts_csv.encode()) + _llm_cache.content_digest(opportunities_csv.encode()),
+        MODEL_ID,
+        FULL_PROMPT_VERSION
+    )
+    result = _llm_cache.get(cache_key)
+    if result is not None:
+        activity.logger.info("LLM cache hit for combined CRM analysis")
     else:
-        schema = {
-            "required_fields": ["total_opportunities", "total_pipeline_value", "won_value", "stages_breakdown", "win_rate"]
-        }
+        # Reuse the worker's prebuilt agent for this role - one LLM call for both datasets
+        agent = _get_agent("crm_full", "CRMFullAnalysis")
+        result = _call_llm_safe(agent, _full_prompt, (contact_stats, opp_stats))
+        if result is None:
+            activity.logger.info("Combined prompt over token budget - analyzing datasets separately")
+            return {"split": True}
 
-    # Load source data for cross-validation
-    source_data = None
-    if source_file and os.path.exists(source_file):
-        with open(source_file) as f:
-            source_data = list(csv.DictReader(f))
+        # Cache the raw LLM output
+        _llm_cache.put(cache_key, result)
 
-    # STEP 1: Fast deterministic validation (catches 90% of issues)
-    deterministic_result = deterministic_validate(analysis_type, analysis, schema, source_data)
-    if not deterministic_result["passed"]:
-        return deterministic_result  # Fail fast, save AI costs
+    return {
+        "contacts": {"result": _finalize_llm_contact_result(result["contacts"], contact_stats), "_source_stats": _contact_source_stats(contact_stats)},
+        "opportunities": {"result": result["opportunities"], "_source_stats": _opportunity_source_stats(opp_stats)}
+    }
 
-    # For contacts, deterministic validation with source data cross-reference is sufficient
-    # Skip AI validation since we've already verified all counts against source data
-    if analysis_type == "contacts":
-        return {"passed": True, "reason": "Deterministic validation passed - all counts verified against source data"}
-
-    # STEP 2: AI semantic validation (hallucination detection, deeper analysis)
-    # Only needed for opportunities to verify win_rate calculation
-    agent = Agent(
-        model=OpenAIChat(id="gpt-4o-mini", api_key=os.getenv("OPENAI_API_KEY")),
-        description="You are a data quality validator. Check for semantic issues and hallucinations.",
-        output_schema=ValidationResult,
-        structured_outputs=True
-    )
+def deterministic_validate(analysis_type: str, analysis: dict, required: frozenset, source_stats: dict) -> dict:
+    """Fast deterministic validation - check fields, types, and ranges"""
 
-    # Build validation prompt with type-specific context
-    if analysis_type == "opportunities":
-        prompt = f"""Validate this {analysis_type} analysis for semantic correctness.
+    # Check for missing required fields
+    missing = required - analysis.keys()
+    if missing:
+        return {"passed": False, "reason": f"Missing fields: {', '.join(sorted(missing))}"}
 
-Data: {json.dumps(analysis, indent=2)}
+    # Single pass: rate fields must be between 0 and 1, everything else non-negative
+    for key, value in analysis.items():
+        if not isinstance(value, (int, float)):
+            continue
+        if key in _RATE_KEYS:
+            if not (0 <= value <= 1):
+                return {"passed": False, "reason": f"Invalid rate {key}: {value}"}
+        elif value < 0:
+            return {"passed": False, "reason": f"Negative value for {key}: {value}"}
+
+    # Logical consistency checks
+    if analysis_type == "contacts":
+        if analysis.get("total_contacts", 0) < analysis.get("unique_companies", 0):
+            return {"passed": False, "reason": "total_contacts < unique_companies"}
 
-IMPORTANT CONTEXT:
-- win_rate is calculated as VALUE-BASED, not count-based: win_rate = won_value / total_pipeline_value
-- This means win_rate represents the percentage of revenue won, not the percentage of opportunities won
-- For example: if won_value=$80,000 and total_pipeline_value=$130,000, then win_rate=0.6154 (61.54%)
-- Do NOT expect win_rate to equal (number of Closed Won opportunities) / (total opportunities)
+        # Cross-reference with the stats parsed from the source data
+        actual_total = source_stats["total"]
+        actual_unique_companies = source_stats["unique_companies"]
+        actual_unique_titles = source_stats["unique_titles"]
 
-Check for:
-1. Hallucinated or nonsensical values (e.g., impossible company names, weird numbers)
-2. Semantic inconsistencies (e.g., distributions don't match totals)
-3. win_rate should equal won_value / total_pipeline_value (value-based calculation)
+        if analysis.get("total_contacts") != actual_total:
+            return {"passed": False, "reason": f"total_contacts mismatch: reported {analysis.get('total_contacts')}, actual {actual_total}"}
 
-The data already passed basic checks (fields exist, no negatives, rates are 0-1).
-Focus ONLY on semantic/logical issues an LLM might introduce.
+        if analysis.get("unique_companies") != actual_unique_companies:
+            return {"passed": False, "reason": f"unique_companies mismatch: reported {analysis.get('unique_companies')}, actual {actual_unique_companies}"}
 
-Return passed=true if semantically valid, passed=false if you detect hallucinations."""
-    else:
-        prompt = f"""Validate this {analysis_type} analysis for semantic correctness.
+        if analysis.get("unique_titles") != actual_unique_titles:
+            return {"passed": False, "reason": f"unique_titles mismatch: reported {analysis.get('unique_titles')}, actual {actual_unique_titles}"}
 
-Data: {json.dumps(analysis, indent=2)}
+        # Verify the company distribution sums to the number of contacts with a company
+        dist_sum = analysis.get("companies_distribution_sum")
+        if dist_sum != source_stats["dist_sum"]:
+            return {"passed": False, "reason": f"companies_distribution_sum ({dist_sum}) doesn't match contacts with a company ({source_stats['dist_sum']})"}
+    elif analysis_type == "opportunities":
+        if analysis.get("won_value", 0) > analysis.get("total_pipeline_value", 0):
+            return {"passed": False, "reason": "won_value > total_pipeline_value"}
 
-IMPORTANT CONTEXT:
-- The data has already passed deterministic validation that cross-referenced the source data
-- If total_contacts matches the sum of companies_distribution values, that is CORRECT (e.g., 3+1+1=5 is valid)
-- If unique_titles equals total_contacts, that is VALID (it means each contact has a different title)
-- unique_titles can be equal to or less than total_contacts (multiple contacts can share the same title)
-- The deterministic validation already verified counts match the source data
+        # win_rate is value-based: won_value / total_pipeline_value
+        tpv = analysis.get("total_pipeline_value", 0)
+        wv = analysis.get("won_value", 0)
+        wr = analysis.get("win_rate", 0)
+        if tpv > 0 and not math.isclose(wr, wv / tpv, rel_tol=1e-3, abs_tol=1e-6):
+            return {"passed": False, "reason": f"win_rate {wr} != won_value/total_pipeline_value ({wv / tpv:.4f})"}
 
-Check for:
-1. Hallucinated or nonsensical values (e.g., impossible company names, weird numbers)
-2. Semantic inconsistencies that weren't caught by deterministic checks
+        # Cross-reference with the stats parsed from the source data
+        if analysis.get("total_opportunities") != source_stats["total"]:
+            return {"passed": False, "reason": f"total_opportunities mismatch: reported {analysis.get('total_opportunities')}, actual {source_stats['total']}"}
 
-The data already passed basic checks (fields exist, no negatives, rates are 0-1, counts verified against source).
-Focus ONLY on semantic/logical issues an LLM might introduce that deterministic checks can't catch.
+        if not math.isclose(analysis.get("total_pipeline_value", 0), source_stats["total_amount"], rel_tol=1e-9, abs_tol=0.005):
+            return {"passed": False, "reason": f"total_pipeline_value mismatch: reported {analysis.get('total_pipeline_value')}, actual {source_stats['total_amount']}"}
 
-Return passed=true if semantically valid, passed=false if you detect hallucinations."""
+        if not math.isclose(analysis.get("won_value", 0), source_stats["won_amount"], rel_tol=1e-9, abs_tol=0.005):
+            return {"passed": False, "reason": f"won_value mismatch: reported {analysis.get('won_value')}, actual {source_stats['won_amount']}"}
 
-    response = agent.run(prompt)
-    return response.content.model_dump()
+    return {"passed": True, "reason": "Deterministic checks passed"}
 
 @activity.defn
-async def combine_analysis(contact_analysis: dict, opp_analysis: dict) -> dict:
-    """Combine analyses into final CRM analysis report"""
-    activity.logger.info("Combining analyses into final report")
+async def validate_analysis(analysis_type: str, analysis: dict, source_stats: dict) -> dict:
+    """Deterministic validation: schema, ranges, and cross-checks against source stats"""
+    activity.logger.info(f"Validating {analysis_type} analysis")
 
-    return {
-        "crm_summary": {
-            "contacts": contact_analysis,
-            "opportunities": opp_analysis
-        },
-        "key_insights": [
-            f"Managing {contact_analysis['total_contacts']} contacts across {contact_analysis['unique_companies']} companies",
-            f"Top customer: {contact_analysis['top_company']['name']} ({contact_analysis['top_company']['count']} contacts)",
-            f"Pipeline value: ${opp_analysis['total_pipeline_value']:,.0f} across {opp_analysis['total_opportunities']} opportunities",
-            f"Closed revenue: ${opp_analysis['won_value']:,.0f} (Win rate: {opp_analysis['win_rate']:.1%})"
-        ],
-        "status": "analysis_completed_successfully"
-    }
+    # Pick the expected schema
+    required = _REQUIRED_CONTACTS if analysis_type == "contacts" else _REQUIRED_OPPS
+
+    # Fast deterministic validation
+    deterministic_result = deterministic_validate(analysis_type, analysis, required, source_stats)
+    if not deterministic_result["passed"]:
+        return deterministic_result
 
+    # Every field is verified against source data (and win_rate against its formula),
+    # so no AI validation pass is needed for either analysis type
+    return {"passed": True, "reason": "Deterministic validation passed - all values verified against source data"}
@@ -0,0 +1,44 @@
+import dataclasses
+from typing import Sequence
+import temporalio.converter
+from temporalio.api.common.v1 import Payload
+from temporalio.converter import PayloadCodec
+import zstandard
+
+# Payloads smaller than this pass through as plain JSON so the Temporal Web UI can show them;
+# in practice only the CSV content in workflow params and activity args is compressed
+COMPRESS_THRESHOLD_BYTES = 64 * 1024
+
+class ZstdPayloadCodec(PayloadCodec):
+    """Transparently zstd-compress large payloads (the CSV content shipped through the workflow)"""
+
+    def __init__(self, level: int = 3, threshold: int = COMPRESS_THRESHOLD_BYTES):
+        self._threshold = threshold
+        self._compressor = zstandard.ZstdCompressor(level=level)
+        self._decompressor = zstandard.ZstdDecompressor()
+
+    async def encode(self, payloads: Sequence[Payload]) -> list[Payload]:
+        return [
+            Payload(
+                metadata={"encoding": b"binary/zstd"},
+                data=self._compressor.compress(p.SerializeToString())
+            )
+            if p.ByteSize() >= self._threshold else p
+            for p in payloads
+        ]
+
+    async def decode(self, payloads: Sequence[Payload]) -> list[Payload]:
+        decoded = []
+        for p in payloads:
+            # Pass through anything this codec didn't encode
+            if p.metadata.get("encoding", b"") != b"binary/zstd":
+                decoded.append(p)
+                continue
+            decoded.append(Payload.FromString(self._decompressor.decompress(p.data)))
+        return decoded
+
+# Use this for both the client and the worker so they agree on the payload format
+CRM_DATA_CONVERTER = dataclasses.replace(
+    temporalio.converter.default(),
+    payload_codec=ZstdPayloadCodec()
+)
@@ -3,24 +3,47 @@ import json
 from temporalio.client import Client
 from temporalio.worker import Worker
 from workflow import CRMAnalysisWorkflow, CRMAnalysisParams
+from codec import CRM_DATA_CONVERTER
 from activities import (
+    analyze_all,
     analyze_contacts,
     analyze_opportunities,
     validate_analysis,
-    combine_analysis
+    warm_tokenizer
 )
 
+# Temporal's default blob size limit - larger workflow inputs are rejected by the server
+MAX_PAYLOAD_BYTES = 2 * 1024 * 1024
+
+def read_csv(path: str) -> str:
+    """Read a CSV once on the launcher; its content travels with the workflow"""
+    with open(path, newline="") as f:
+        return f.read()
+
+async def check_payload_size(params: CRMAnalysisParams) -> None:
+    """Fail fast with a clear message if the encoded input (compressed once large) is over the blob size limit"""
+    payloads = await CRM_DATA_CONVERTER.encode([params])
+    size = sum(p.ByteSize() for p in payloads)
+    if size > MAX_PAYLOAD_BYTES:
+        raise ValueError(
+            f"Workflow input is {size:,} bytes after encoding, over Temporal's "
+            f"{MAX_PAYLOAD_BYTES:,}-byte payload limit - split the CSV exports into smaller batches"
+        )
+
 async def main():
     # Connect to Temporal server
-    client = await Client.connect("localhost:7233")
+    client = await Client.connect("localhost:7233", data_converter=CRM_DATA_CONVERTER)
+
+    params = CRMAnalysisParams(
+        contacts_csv=read_csv("crm_contacts.csv"),
+        opportunities_csv=read_csv("crm_opportunities.csv")
+    )
+    await check_payload_size(params)
 
     # Run workflow directly (for demo purposes)
     result = await client.execute_workflow(
         CRMAnalysisWorkflow.run,
-        CRMAnalysisParams(
-            contacts_file="crm_contacts.csv",
-            opportunities_file="crm_opportunities.csv"
-        ),
+        params,
         id="crm-analysis-demo",
         task_queue="crm-analysis"
     )
@@ -40,20 +63,23 @@ async def main():
 
 async def run_worker():
     """Run worker in background to execute workflows"""
-    client = await Client.connect("localhost:7233")
+    client = await Client.connect("localhost:7233", data_converter=CRM_DATA_CONVERTER)
 
     worker = Worker(
         client,
         task_queue="crm-analysis",
         workflows=[CRMAnalysisWorkflow],
         activities=[
+            analyze_all,
             analyze_contacts,
             analyze_opportunities,
-            validate_analysis,
-            combine_analysis
+            validate_analysis
         ]
     )
 
+    # Load the tokenizer (may download it) before taking any activities
+    await asyncio.to_thread(warm_tokenizer)
+
     print("🔧 Worker started. Listening for workflows...")
     await worker.run()
 
@@ -64,5 +90,11 @@ if __name__ == "__main__":
         await asyncio.sleep(2)  # Give worker time to start
         await main()
 
-    asyncio.run(run_all())
+    # Use uvloop's faster event loop when it's installed (not available on Windows)
+    try:
+        import uvloop
+    except ImportError:
+        asyncio.run(run_all())
+    else:
+        uvloop.run(run_all())
 
@@ -6,57 +6,77 @@ import asyncio
 
 @dataclass
 class CRMAnalysisParams:
-    contacts_file: str
-    opportunities_file: str
+    # CSV content rather than file paths, so any worker can run the activities
+    # without a shared filesystem (large payloads are zstd-compressed by the codec)
+    contacts_csv: str
+    opportunities_csv: str
 
 @workflow.defn
 class CRMAnalysisWorkflow:
     @workflow.run
     async def run(self, params: CRMAnalysisParams) -> dict:
-        # PARALLEL EXECUTION: Analyze contacts and opportunities concurrently
-        contact_task = workflow.execute_activity(
-            "analyze_contacts",
-            args=[params.contacts_file],
+        # Analyze contacts and opportunities in one activity (one LLM round-trip when AI is enabled)
+        crm_output = await workflow.execute_activity(
+            "analyze_all",
+            args=[params.contacts_csv, params.opportunities_csv],
             start_to_close_timeout=timedelta(minutes=2),
             retry_policy=RetryPolicy(maximum_attempts=2)
         )
 
-        opportunity_task = workflow.execute_activity(
-            "analyze_opportunities",
-            args=[params.opportunities_file],
-            start_to_close_timeout=timedelta(minutes=2),
-            retry_policy=RetryPolicy(maximum_attempts=2)
-        )
+        if crm_output.get("split"):
+            # FALLBACK: Analyze contacts and opportunities as separate activities, in parallel
+            contact_task = workflow.execute_activity(
+                "analyze_contacts",
+                args=[params.contacts_csv],
+                start_to_close_timeout=timedelta(minutes=2),
+                retry_policy=RetryPolicy(maximum_attempts=2)
+            )
 
-        # Wait for both parallel tasks to complete
-        contact_analysis, opportunity_analysis = await asyncio.gather(
-            contact_task, opportunity_task
-        )
+            opportunity_task = workflow.execute_activity(
+                "analyze_opportunities",
+                args=[params.opportunities_csv],
+                start_to_close_timeout=timedelta(minutes=2),
+                retry_policy=RetryPolicy(maximum_attempts=2)
+            )
+
+            contact_output, opportunity_output = await asyncio.gather(
+                contact_task, opportunity_task
+            )
+        else:
+            contact_output = crm_output["contacts"]
+            opportunity_output = crm_output["opportunities"]
+
+        # Each analysis also carries the source stats it parsed, so validation never re-reads the CSVs
+        contact_analysis = contact_output["result"]
+        opportunity_analysis = opportunity_output["result"]
 
         # CHECKPOINT: Both analyses complete, state persisted
 
-        # VALIDATION: Check contact analysis for issues
-        contact_validation = await workflow.execute_activity(
+        # PARALLEL VALIDATION: Each check only depends on its own analysis
+        contact_validation_task = workflow.execute_activity(
+            "validate_analysis",
+            args=["contacts", contact_analysis, contact_output["_source_stats"]],
+            start_to_close_timeout=timedelta(seconds=30),
+            retry_policy=RetryPolicy(maximum_attempts=2)
+        )
+
+        opp_validation_task = workflow.execute_activity(
             "validate_analysis",
-            args=["contacts", contact_analysis, params.contacts_file],
+            args=["opportunities", opportunity_analysis, opportunity_output["_source_stats"]],
             start_to_close_timeout=timedelta(seconds=30),
             retry_policy=RetryPolicy(maximum_attempts=2)
         )
 
+        contact_validation, opp_validation = await asyncio.gather(
+            contact_validation_task, opp_validation_task
+        )
+
         if not contact_validation["passed"]:
             return {
                 "error": "Contact analysis validation failed",
                 "reason": contact_validation["reason"]
             }
 
-        # VALIDATION: Check opportunity analysis for issues
-        opp_validation = await workflow.execute_activity(
-            "validate_analysis",
-            args=["opportunities", opportunity_analysis, params.opportunities_file],
-            start_to_close_timeout=timedelta(seconds=30),
-            retry_policy=RetryPolicy(maximum_attempts=2)
-        )
-
         if not opp_validation["passed"]:
             return {
                 "error": "Opportunity analysis validation failed",
@@ -66,12 +86,19 @@ class CRMAnalysisWorkflow:
         # CHECKPOINT: Validations passed, state persisted
 
         # FINAL STEP: Combine analyses into final report
-        analysis_report = await workflow.execute_activity(
-            "combine_analysis",
-            args=[contact_analysis, opportunity_analysis],
-            start_to_close_timeout=timedelta(seconds=30),
-            retry_policy=RetryPolicy(maximum_attempts=3)
-        )
-
-        return analysis_report
+        # Pure formatting with no I/O, so it runs inline instead of as an activity
+        workflow.logger.info("Combining analyses into final report")
 
+        return {
+            "crm_summary": {
+                "contacts": contact_analysis,
+                "opportunities": opportunity_analysis
+            },
+            "key_insights": [
+                f"Managing {contact_analysis['total_contacts']} contacts across {contact_analysis['unique_companies']} companies",
+                f"Top customer: {contact_analysis['top_company']['name']} ({contact_analysis['top_company']['count']} contacts)",
+                f"Pipeline value: ${opportunity_analysis['total_pipeline_value']:,.0f} across {opportunity_analysis['total_opportunities']} opportunities",
+                f"Closed revenue: ${opportunity_analysis['won_value']:,.0f} (Win rate: {opportunity_analysis['win_rate']:.1%})"
+            ],
+            "status": "analysis_completed_successfully"
+        }